@@ -1,8 +1,30 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from typing import Union, Optional, Dict, List, Literal
+from functools import reduce
+import importlib.util
+import operator
 import os
 from datetime import datetime
 
+# polars and dask are optional backends and slow to import, so they are only
+# imported by the functions using them (main.py imports this module as well)
+
+# Use the faster calamine reader for Excel files when it is installed
+EXCEL_ENGINE = 'calamine' if importlib.util.find_spec('python_calamine') else None
+
+# Arrow-backed string dtype used for the 'contains' and 'starts_with' conditions
+STRING_DTYPE = pd.StringDtype('pyarrow')
+
+# Rows per Parquet row group in the dask cache; each row group becomes one dask partition
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+# Characters that make a 'contains' value a regular expression rather than plain text
+REGEX_CHARACTERS = set('.^$*+?{}[]\\|()')
+
 class FilterCondition:
     """
     Class to define filter conditions for Excel data.
@@ -34,59 +56,352 @@ class FilterGroup:
     def __init__(self, conditions: List[FilterCondition]):
         self.conditions = conditions
 
+def iter_conditions(filter_groups: List[Union[FilterGroup, FilterCondition]]):
+    """Yield every FilterCondition from a list of FilterGroups and FilterConditions"""
+    for group in filter_groups:
+        if isinstance(group, FilterCondition):
+            yield group
+        else:
+            yield from group.conditions
+
+def prepare_filter_columns(
+    df: pd.DataFrame,
+    filter_groups: List[Union[FilterGroup, FilterCondition]],
+) -> None:
+    """
+    Check that every filtered column exists and convert date and string columns
+    in place, so each column is converted at most once before any masks are computed.
+    """
+    string_columns = set()
+    for condition in iter_conditions(filter_groups):
+        if condition.column not in df.columns:
+            raise KeyError(f"Column '{condition.column}' not found in the Excel file")
+        
+        if condition.condition.startswith('date_') and not pd.api.types.is_datetime64_any_dtype(df[condition.column]):
+            df[condition.column] = pd.to_datetime(df[condition.column], format=condition.date_format, errors='coerce')
+        elif condition.condition in ['contains', 'starts_with'] and df[condition.column].dtype != STRING_DTYPE:
+            string_columns.add(condition.column)
+    
+    if string_columns:
+        string_columns = list(string_columns)
+        df[string_columns] = df[string_columns].astype(STRING_DTYPE)
+
+def parse_date_columns(df: pd.DataFrame, date_columns: Optional[Dict[str, str]] = None) -> None:
+    """Helper function to parse the known date columns that weren't read as datetimes, in place"""
+    for column, date_format in (date_columns or {}).items():
+        if not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], format=date_format, errors='coerce')
+
+def parse_filter_date(condition: FilterCondition) -> pd.Timestamp:
+    """Helper function to return the value of a date condition as a Timestamp"""
+    # Convert value to datetime if it's a string
+    if isinstance(condition.value, str):
+        return pd.to_datetime(condition.value, format=condition.date_format)
+    return pd.Timestamp(condition.value)
+
+def contains_mask(column: pd.Series, value) -> np.ndarray:
+    """Helper function to match rows of an Arrow-backed string column containing a value"""
+    # Plain substrings skip the regex engine, matching pandas' str.contains otherwise
+    pattern = str(value)
+    if REGEX_CHARACTERS.intersection(pattern):
+        matches = pc.match_substring_regex(pa.array(column.array), pattern)
+    else:
+        matches = pc.match_substring(pa.array(column.array), pattern)
+    return pc.fill_null(matches, False).to_numpy(zero_copy_only=False)
+
+def starts_with_mask(column: pd.Series, value) -> np.ndarray:
+    """Helper function to match rows of an Arrow-backed string column starting with a value"""
+    matches = pc.starts_with(pa.array(column.array), str(value))
+    return pc.fill_null(matches, False).to_numpy(zero_copy_only=False)
+
+# Mask builders for each condition, called with the prepared column and filter value.
+# Date conditions receive the column and value as datetime64[D] days.
+CONDITION_MASKS = {
+    'equals': operator.eq,
+    'contains': contains_mask,
+    'starts_with': starts_with_mask,
+    'in': lambda column, value: column.isin(value),
+    'greater_than': operator.gt,
+    'less_than': operator.lt,
+    'date_equals': operator.eq,
+    'date_greater': operator.gt,
+    'date_less': operator.lt,
+}
+
 def apply_filter_condition(df: pd.DataFrame, condition: FilterCondition) -> pd.Series:
     """Helper function to apply a single filter condition and return a boolean mask"""
+    if condition.condition not in CONDITION_MASKS:
+        raise ValueError(f"Unknown filter condition '{condition.condition}'")
+    
+    column = df[condition.column]
     if condition.condition.startswith('date_'):
-        # Convert column to datetime if it's not already
-        if not pd.api.types.is_datetime64_any_dtype(df[condition.column]):
-            df[condition.column] = pd.to_datetime(df[condition.column], format=condition.date_format, errors='coerce')
+        # Convert column to datetime if it wasn't prepared beforehand
+        if not pd.api.types.is_datetime64_any_dtype(column):
+            column = pd.to_datetime(column, format=condition.date_format, errors='coerce')
         
-        # Convert value to datetime if it's a string
-        if isinstance(condition.value, str):
-            filter_date = pd.to_datetime(condition.value, format=condition.date_format)
-        else:
-            filter_date = condition.value
-        
-        if condition.condition == 'date_equals':
-            return df[condition.column].dt.date == filter_date.date()
-        elif condition.condition == 'date_greater':
-            return df[condition.column].dt.date > filter_date.date()
-        elif condition.condition == 'date_less':
-            return df[condition.column].dt.date < filter_date.date()
+        # Compare whole days on the raw datetime64 values instead of per-row date objects
+        column = column.values.astype('datetime64[D]')
+        value = np.datetime64(parse_filter_date(condition).date(), 'D')
     else:
-        # Convert column to string if needed for string operations
-        if condition.condition in ['contains', 'starts_with']:
-            df[condition.column] = df[condition.column].astype(str)
-            
+        # Convert column to string if needed for string operations and it wasn't prepared beforehand
+        if condition.condition in ['contains', 'starts_with'] and column.dtype != STRING_DTYPE:
+            column = column.astype(STRING_DTYPE)
+        value = condition.value
+    
+    mask = CONDITION_MASKS[condition.condition](column, value)
+    if isinstance(mask, pd.Series):
+        return mask
+    return pd.Series(mask, index=df.index)
+
+def filter_dataframe(
+    df: pd.DataFrame,
+    filter_groups: List[Union[FilterGroup, FilterCondition]],
+) -> pd.DataFrame:
+    """Helper function to return the rows of a DataFrame matching all filter groups"""
+    # Upgrade the filtered columns once, then compute every mask against the same frame
+    prepare_filter_columns(df, filter_groups)
+    
+    # Combine the mask of each filter group or condition and slice the data once
+    final_mask = np.ones(len(df), dtype=bool)
+    for group in filter_groups:
+        if isinstance(group, FilterCondition):
+            # Single condition - treat as AND
+            mask = apply_filter_condition(df, group)
+            final_mask &= mask.to_numpy(dtype=bool, na_value=False)
+        else:
+            # Group of conditions - combine with OR
+            condition_masks = [
+                apply_filter_condition(df, condition).to_numpy(dtype=bool, na_value=False)
+                for condition in group.conditions
+            ]
+            if condition_masks:
+                final_mask &= np.logical_or.reduce(condition_masks)
+            else:
+                final_mask[:] = False
+    
+    return df.loc[final_mask]
+
+# Expression builders for each condition, called with the prepared column and filter value.
+# Date conditions receive the column and value as dates.
+POLARS_CONDITION_EXPRS = {
+    'equals': operator.eq,
+    'contains': lambda column, value: column.str.contains(str(value)),
+    'starts_with': lambda column, value: column.str.starts_with(str(value)),
+    'in': lambda column, value: column.is_in(value),
+    'greater_than': operator.gt,
+    'less_than': operator.lt,
+    'date_equals': operator.eq,
+    'date_greater': operator.gt,
+    'date_less': operator.lt,
+}
+
+def polars_comparison_value(condition: FilterCondition, dtype: "pl.DataType"):
+    """
+    Helper function to match a comparison value to the column's polars dtype, as pandas would compare it.
+    Mixed columns are read as text, so values are compared as text against string columns.
+    Returns None for equals when text is compared with a numeric column, as nothing can match.
+    """
+    import polars as pl
+    
+    is_text_column = dtype == pl.String
+    if condition.condition == 'in':
+        if is_text_column:
+            return [str(value) for value in condition.value]
+        if dtype.is_numeric():
+            return [value for value in condition.value if not isinstance(value, str)]
+        return condition.value
+    
+    value = condition.value
+    if is_text_column != isinstance(value, str) and (is_text_column or dtype.is_numeric()):
         if condition.condition == 'equals':
-            return df[condition.column] == condition.value
-        elif condition.condition == 'contains':
-            return df[condition.column].str.contains(str(condition.value), na=False)
-        elif condition.condition == 'starts_with':
-            return df[condition.column].str.startswith(str(condition.value))
-        elif condition.condition == 'in':
-            return df[condition.column].isin(condition.value)
-        elif condition.condition == 'greater_than':
-            return df[condition.column] > condition.value
-        elif condition.condition == 'less_than':
-            return df[condition.column] < condition.value
-    
-    return pd.Series(True, index=df.index)
+            return str(value) if is_text_column else None
+        raise TypeError(
+            f"Cannot apply '{condition.condition}' to column '{condition.column}' ({dtype}) "
+            f"with value {value!r}"
+        )
+    return value
+
+def polars_condition_expr(condition: FilterCondition, schema: "pl.Schema") -> "pl.Expr":
+    """Helper function to translate a single filter condition into a polars expression"""
+    if condition.condition not in POLARS_CONDITION_EXPRS:
+        raise ValueError(f"Unknown filter condition '{condition.condition}'")
+    import polars as pl
+    
+    column = pl.col(condition.column)
+    if condition.condition.startswith('date_'):
+        # Convert column to datetime if it wasn't read as one
+        if schema[condition.column] == pl.String:
+            column = column.str.to_datetime(condition.date_format, strict=False)
+        column = column.dt.date()
+        value = parse_filter_date(condition).date()
+    elif condition.condition in ['contains', 'starts_with']:
+        # Convert column to string if needed for string operations
+        column = column.cast(pl.String)
+        value = condition.value
+    else:
+        value = polars_comparison_value(condition, schema[condition.column])
+        if value is None:
+            return pl.lit(False)
+    
+    return POLARS_CONDITION_EXPRS[condition.condition](column, value).fill_null(False)
+
+def filter_with_polars(
+    input_file: str,
+    filter_groups: List[Union[FilterGroup, FilterCondition]],
+    date_columns: Optional[Dict[str, str]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read and filter an Excel file with polars, returning the matching rows as a pandas DataFrame.
+    Conditions are combined into a single expression and evaluated by polars' multi-threaded engine.
+    If columns is given, only those columns are read from the file.
+    """
+    try:
+        import polars as pl
+    except ImportError:
+        raise ImportError("The polars backend requires polars; install it with the 'polars' extra") from None
+    
+    lf = pl.read_excel(input_file, columns=columns).lazy()
+    schema = lf.collect_schema()
+    
+    # Parse any known date columns that were read as strings
+    for column, date_format in (date_columns or {}).items():
+        if column in schema and schema[column] == pl.String:
+            lf = lf.with_columns(pl.col(column).str.to_datetime(date_format, strict=False))
+    schema = lf.collect_schema()
+    
+    # Conditions within a group are combined with OR, groups are combined with AND
+    group_exprs = []
+    for group in filter_groups:
+        conditions = [group] if isinstance(group, FilterCondition) else group.conditions
+        for condition in conditions:
+            if condition.column not in schema:
+                raise KeyError(f"Column '{condition.column}' not found in the Excel file")
+        exprs = [polars_condition_expr(condition, schema) for condition in conditions]
+        group_exprs.append(reduce(operator.or_, exprs, pl.lit(False)))
+    
+    return lf.filter(reduce(operator.and_, group_exprs, pl.lit(True))).collect().to_pandas()
+
+def text_comparison_condition(condition: FilterCondition, dtype) -> FilterCondition:
+    """
+    Helper function to compare the value of an equals or in condition as text against a string column.
+    The Parquet cache stores columns mixing text and numbers as text, so numbers are matched by their text.
+    """
+    if condition.condition not in ['equals', 'in'] or not pd.api.types.is_string_dtype(dtype):
+        return condition
+    
+    if condition.condition == 'in':
+        value = [str(item) for item in condition.value]
+    else:
+        value = str(condition.value)
+    return FilterCondition(condition.column, value, condition.condition, condition.date_format)
+
+def filter_partition(
+    df: pd.DataFrame,
+    filter_groups: List[Union[FilterGroup, FilterCondition]],
+    date_columns: Optional[Dict[str, str]] = None,
+    row_offsets: Optional[List[int]] = None,
+    partition_info: Optional[dict] = None,
+) -> pd.DataFrame:
+    """
+    Helper function to parse known date columns and filter one partition of a dask DataFrame.
+    Rows are numbered by their position in the file, starting from the partition's row offset.
+    """
+    # dask passes partition_info for real partitions, but not while inferring the output metadata
+    if row_offsets is not None and partition_info is not None:
+        start = row_offsets[partition_info['number']]
+        df.index = pd.RangeIndex(start, start + len(df))
+    parse_date_columns(df, date_columns)
+    return filter_dataframe(df, filter_groups)
+
+def excel_to_parquet_cache(input_file: str) -> str:
+    """
+    Convert an Excel file to a Parquet file next to it, reusing the existing
+    conversion unless the Excel file has changed since, and return its path.
+    The conversion reads the whole sheet into memory once, since Excel files
+    can't be read in pieces; later runs only read the Parquet file.
+    Columns mixing text and numbers are stored as text.
+    """
+    parquet_file = input_file + '.parquet'
+    if os.path.exists(parquet_file) and os.path.getmtime(parquet_file) >= os.path.getmtime(input_file):
+        return parquet_file
+    
+    df = make_parquet_compatible(pd.read_excel(input_file, engine=EXCEL_ENGINE))
+    df.to_parquet(parquet_file, index=False, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return parquet_file
+
+def filter_with_dask(
+    input_file: str,
+    filter_groups: List[Union[FilterGroup, FilterCondition]],
+    date_columns: Optional[Dict[str, str]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Filter an Excel or Parquet file with dask, returning the matching rows as a pandas DataFrame.
+    Excel files are converted to a cached Parquet file first (see excel_to_parquet_cache), which
+    is then filtered one row group at a time so only the matching rows are held in memory.
+    If columns is given, only those columns are read from the file. Rows keep their position
+    in the file as the index, like the rows returned by the pandas backend.
+    
+    Because the cache stores columns mixing text and numbers as text, equals and in conditions
+    compare numbers with such columns by their text, so FilterCondition('Zone/Zonal Council', 6)
+    matches both the numeric and the text cells holding 6.
+    """
+    try:
+        import dask.dataframe as dd
+    except ImportError:
+        raise ImportError("The dask backend requires dask; install it with the 'dask' extra") from None
+    
+    if input_file.lower().endswith('.parquet'):
+        parquet_file = input_file
+    else:
+        parquet_file = excel_to_parquet_cache(input_file)
+    
+    # One partition per row group, rather than letting dask merge small row groups into one
+    ddf = dd.read_parquet(parquet_file, columns=columns, split_row_groups=True)
+    for condition in iter_conditions(filter_groups):
+        if condition.column not in ddf.columns:
+            raise KeyError(f"Column '{condition.column}' not found in the Excel file")
+    
+    filter_groups = [
+        text_comparison_condition(group, ddf.dtypes[group.column]) if isinstance(group, FilterCondition)
+        else FilterGroup([text_comparison_condition(condition, ddf.dtypes[condition.column]) for condition in group.conditions])
+        for group in filter_groups
+    ]
+    
+    # Each partition is one row group, so its rows start after those of the previous row groups
+    metadata = pq.read_metadata(parquet_file)
+    row_counts = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    row_offsets = [0] + np.cumsum(row_counts[:-1], dtype=np.int64).tolist()
+    
+    return ddf.map_partitions(filter_partition, filter_groups, date_columns, row_offsets).compute()
 
 def filter_excel_data(
     input_file: str,
     filter_groups: List[Union[FilterGroup, FilterCondition]],
     output_file: Optional[str] = None,
+    date_columns: Optional[Dict[str, str]] = None,
+    backend: Literal['pandas', 'polars', 'dask'] = 'pandas',
+    keep_columns: Optional[List[str]] = None,
 ) -> pd.DataFrame:
     """
     Filter Excel file based on multiple conditions across different columns.
     
     Args:
-        input_file (str): Path to the input Excel file
+        input_file (str): Path to the input Excel file (or Parquet file with the dask backend)
         filter_groups (List[Union[FilterGroup, FilterCondition]]): List of FilterGroups or FilterConditions
             - Conditions within a FilterGroup are combined with OR logic
             - Different FilterGroups or individual FilterConditions are combined with AND logic
-        output_file (str, optional): Path to save filtered data. If None, data won't be saved
+        output_file (str, optional): Path to save filtered data (.xlsx or .parquet). If None, data won't be saved
+        date_columns (Dict[str, str], optional): Mapping of column name to date format
+            (e.g., {'Timestamp': '%d/%m/%Y'}). Columns not read as datetime cells are parsed
+            once after reading, so date conditions on them don't need to convert the column
+        backend (str): Library used to read and filter the data. 'polars' requires the
+            optional polars dependencies and is faster on large files. 'dask' requires the
+            optional dask dependencies and filters files too large to fit in memory; see
+            filter_with_dask for how it treats columns mixing text and numbers
+        keep_columns (List[str], optional): Columns to return. If given, only these and the
+            filtered columns are read from the file. If None, all columns are returned
     
     Returns:
         pd.DataFrame: Filtered DataFrame containing only rows matching the conditions
@@ -95,26 +410,40 @@ def filter_excel_data(
     if not os.path.exists(input_file):
         raise FileNotFoundError(f"Input file not found: {input_file}")
     
-    # Read the Excel file
-    df = pd.read_excel(input_file)
+    # Reject unknown conditions before reading any data
+    for condition in iter_conditions(filter_groups):
+        if condition.condition not in CONDITION_MASKS:
+            raise ValueError(f"Unknown filter condition '{condition.condition}'")
     
-    # Process each filter group or condition
-    for group in filter_groups:
-        if isinstance(group, FilterCondition):
-            # Single condition - treat as AND
-            if group.column not in df.columns:
-                raise KeyError(f"Column '{group.column}' not found in the Excel file")
-            mask = apply_filter_condition(df, group)
-            df = df[mask]
-        else:
-            # Group of conditions - combine with OR
-            group_mask = pd.Series(False, index=df.index)
-            for condition in group.conditions:
-                if condition.column not in df.columns:
-                    raise KeyError(f"Column '{condition.column}' not found in the Excel file")
-                condition_mask = apply_filter_condition(df, condition)
-                group_mask = group_mask | condition_mask
-            df = df[group_mask]
+    # Only read the filtered columns and the ones the caller wants to keep
+    needed_columns = None
+    if keep_columns is not None:
+        needed_columns = list(dict.fromkeys(
+            [condition.column for condition in iter_conditions(filter_groups)] + list(keep_columns)
+        ))
+        if date_columns:
+            date_columns = {column: date_format for column, date_format in date_columns.items() if column in needed_columns}
+    
+    if backend == 'polars':
+        df = filter_with_polars(input_file, filter_groups, date_columns, needed_columns)
+    elif backend == 'dask':
+        df = filter_with_dask(input_file, filter_groups, date_columns, needed_columns)
+    else:
+        df = pd.read_excel(
+            input_file,
+            engine=EXCEL_ENGINE,
+            usecols=None if needed_columns is None else (lambda column: column in needed_columns),
+        )
+        # Parse any known date columns that weren't read as datetime cells
+        parse_date_columns(df, date_columns)
+        if keep_columns is not None:
+            for column in keep_columns:
+                if column not in df.columns:
+                    raise KeyError(f"Column '{column}' not found in the Excel file")
+        df = filter_dataframe(df, filter_groups)
+    
+    if keep_columns is not None:
+        df = df[list(keep_columns)]
     
     if output_file:
         # Create output directory if it doesn't exist
@@ -122,12 +451,41 @@ def filter_excel_data(
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir)
             
-        # Save to a new Excel file
-        df.to_excel(output_file, index=False)
+        # Save to a new Excel or Parquet file
+        save_dataframe(df, output_file)
         print(f"Filtered data saved to {output_file}")
     
     return df
 
+def make_parquet_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the DataFrame with columns that mix text and numbers converted to text.
+    Parquet columns need a single type, which Excel columns often don't have.
+    """
+    mixed_columns = [
+        column for column in df.columns
+        if pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed')
+    ]
+    if not mixed_columns:
+        return df
+    df = df.copy()
+    df[mixed_columns] = df[mixed_columns].astype(STRING_DTYPE)
+    return df
+
+def save_dataframe(df: pd.DataFrame, output_file: str, sheet_name: str = 'Sheet1') -> None:
+    """
+    Save a DataFrame in the format given by the output file extension.
+    
+    Args:
+        df (pd.DataFrame): DataFrame to save
+        output_file (str): Path ending in .parquet for a Parquet file, otherwise an Excel file is written
+        sheet_name (str): Name of the sheet when writing an Excel file
+    """
+    if output_file.lower().endswith('.parquet'):
+        make_parquet_compatible(df).to_parquet(output_file, compression='zstd', index=False)
+    else:
+        df.to_excel(output_file, sheet_name=sheet_name, index=False, engine='xlsxwriter')
+
 def get_unique_values(df: pd.DataFrame, column_name: str) -> list:
     """
     Get unique values from a specific column in the DataFrame.
@@ -137,9 +495,12 @@ def get_unique_values(df: pd.DataFrame, column_name: str) -> list:
         column_name (str): Name of the column
     
     Returns:
-        list: Sorted list of unique values
+        list: Sorted list of unique values, excluding missing values
     """
-    return sorted(df[column_name].unique().tolist())
+    values = df[column_name].dropna()
+    if isinstance(values.array, pd.arrays.ArrowExtensionArray):
+        return pc.unique(pa.array(values.array)).sort().to_pylist()
+    return np.unique(values.to_numpy()).tolist()
 
 if __name__ == "__main__": 
     input_file = "./spreadsheets/fse.xlsx"
@@ -172,7 +533,8 @@ if __name__ == "__main__":
         filtered_data = filter_excel_data(
             input_file=input_file,
             filter_groups=filters,
-            output_file=output_file
+            output_file=output_file,
+            date_columns={'Timestamp': '%d/%m/%Y'}
         )
         
         # Print information about the filtered data
@@ -186,7 +548,7 @@ if __name__ == "__main__":
         
         if 'Timestamp' in filtered_data.columns:
             print("\nUnique dates in Timestamp column:")
-            print(sorted(filtered_data['Timestamp'].dt.date.unique().tolist()))
+            print(np.unique(filtered_data['Timestamp'].values.astype('datetime64[D]')).tolist())
         
     except Exception as e:
         print(f"Error: {str(e)}")
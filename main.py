@@ -1,5 +1,10 @@
+import numpy as np
 import pandas as pd
-from fuzzywuzzy import fuzz
+import pyarrow as pa
+import pyarrow.csv as pv
+from rapidfuzz import fuzz, process
+from filter import EXCEL_ENGINE, save_dataframe
+from collections import defaultdict
 import os
 
 # File path constants
@@ -15,36 +20,155 @@ SURVEILLANCE_FILE = 'spreadsheets/surveillance.xlsx'
 # Column name constant
 COLUMN_KEY = 'Name of Facility'
 
-def is_similar_name(name1, name2, threshold=80):
+def normalize_name(name):
     """
-    Check if two names are similar using multiple fuzzy string matching methods.
-    Returns True if the name parts match closely enough.
+    Lowercase a name and collapse its whitespace, so names differing only
+    in case or spacing normalize to the same string.
     """
-    # Handle missing or non-string values
-    if pd.isna(name1) or pd.isna(name2):
-        return False
+    return ' '.join(str(name).lower().split())
+
+def block_key(name):
+    """
+    Return the (first character, length bucket) key used to block a normalized name.
+    Names are only compared against candidates in the same or a neighbouring bucket.
+    """
+    return name[:1], len(name) // 4
+
+def split_name_parts(names):
+    """
+    Split each normalized name into its set of parts, stored as indexes into a list
+    of the unique parts. Returns the unique parts, the parts of each name and the
+    number of parts in each name. Names without parts get the empty string as a
+    placeholder part, which never matches anything.
+    """
+    vocabulary = {}
+    name_parts = []
+    part_counts = []
+    for name in names:
+        parts = set(name.split())
+        part_counts.append(len(parts))
+        name_parts.append(np.array(
+            [vocabulary.setdefault(part, len(vocabulary)) for part in parts or {''}],
+            dtype=np.intp,
+        ))
+    return list(vocabulary), name_parts, np.array(part_counts, dtype=np.intp)
+
+def group_name_parts(indices, name_parts, part_counts):
+    """
+    Concatenate the parts of the given candidates so they can be scored together.
+    Returns the candidate indices, their concatenated parts, the offset of each
+    candidate's first part and the number of parts in each candidate.
+    """
+    indices = np.asarray(indices, dtype=np.intp)
+    lengths = np.array([len(name_parts[i]) for i in indices], dtype=np.intp)
+    flat_parts = np.concatenate([name_parts[i] for i in indices])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return indices, flat_parts, offsets, part_counts[indices]
+
+def best_part_match(response_parts, response_count, candidate_groups, part_scores, similarity_threshold):
+    """
+    Score a response against groups of candidates by comparing their name parts.
+    A candidate matches when the part counts differ by at most one and every part
+    of the response matches some part of the candidate with a ratio of at least
+    the threshold; its score is the ratio of the weakest response part.
+    Returns the best score and the index of the first matching candidate.
+    """
+    best_score = 0
+    first_match = None
+    if not response_count:
+        return best_score, 0
     
-    # Convert both names to lowercase for better matching
-    name1 = str(name1).lower().strip()
-    name2 = str(name2).lower().strip()
+    for indices, flat_parts, offsets, counts in candidate_groups:
+        # Best ratio of each response part within each candidate, then the weakest part decides
+        part_best = np.maximum.reduceat(part_scores[np.ix_(response_parts, flat_parts)], offsets, axis=1)
+        scores = np.where(np.abs(counts - response_count) <= 1, part_best.min(axis=0), 0)
+        best_score = max(best_score, int(scores.max()))
+        
+        matched = indices[scores >= similarity_threshold]
+        if len(matched) and (first_match is None or matched.min() < first_match):
+            first_match = matched.min()
     
-    # Split names into parts
-    parts1 = set(name1.split())
-    parts2 = set(name2.split())
+    return best_score, 0 if first_match is None else first_match
+
+def blocked_candidate_groups(response_names, candidate_names, candidate_parts, candidate_counts):
+    """
+    Return the candidate groups each response is compared against when blocking:
+    the candidates sharing its first character that fall in the same or a
+    neighbouring length bucket.
+    """
+    buckets = defaultdict(list)
+    for idx, name in enumerate(candidate_names):
+        buckets[block_key(name)].append(idx)
+    bucket_groups = {
+        key: group_name_parts(indices, candidate_parts, candidate_counts)
+        for key, indices in buckets.items()
+    }
     
-    # If the number of name parts is different by more than 1, consider it a different name
-    if abs(len(parts1) - len(parts2)) > 1:
-        return False
+    response_groups = []
+    for name in response_names:
+        first_char, length_bucket = block_key(name)
+        response_groups.append([
+            bucket_groups[(first_char, length_bucket + offset)]
+            for offset in (-1, 0, 1)
+            if (first_char, length_bucket + offset) in bucket_groups
+        ])
+    return response_groups
+
+def match_names(response_names, candidate_names, similarity_threshold, use_blocking=False):
+    """
+    Score every response name against the candidate names.
+    Returns the best score and the index of the first matching candidate for each
+    response; scores below the threshold are reported as 0.
+    """
+    # Normalize every name once instead of on every comparison
+    response_names = [normalize_name(name) for name in response_names]
+    candidate_names = [normalize_name(name) for name in candidate_names]
+    
+    # Exact matches after normalization only need a hash lookup
+    candidate_lookup = {}
+    for idx, name in enumerate(candidate_names):
+        if name:
+            candidate_lookup.setdefault(name, idx)
+    exact_idx = np.array([candidate_lookup.get(name, -1) for name in response_names], dtype=np.intp)
+    exact_mask = exact_idx >= 0
+    
+    # Only the remaining responses go through fuzzy scoring. Every response part is
+    # compared with every candidate part in a single matrix of fuzz.ratio scores.
+    remaining_names = [name for name, is_exact in zip(response_names, exact_mask) if not is_exact]
+    response_vocabulary, response_parts, response_counts = split_name_parts(remaining_names)
+    candidate_vocabulary, candidate_parts, candidate_counts = split_name_parts(candidate_names)
+    part_scores = process.cdist(
+        response_vocabulary,
+        candidate_vocabulary,
+        scorer=fuzz.ratio,
+        processor=None,
+        score_cutoff=similarity_threshold,
+        workers=-1,
+        dtype=np.uint8,
+    )
     
-    # Compare each part of the names
-    best_matches = []
-    for part1 in parts1:
-        # Find the best matching part in name2
-        best_match = max((fuzz.ratio(part1, part2) for part2 in parts2), default=0)
-        best_matches.append(best_match)
+    if use_blocking:
+        response_groups = blocked_candidate_groups(
+            remaining_names, candidate_names, candidate_parts, candidate_counts
+        )
+    else:
+        all_candidates = []
+        if candidate_names:
+            all_candidates.append(group_name_parts(range(len(candidate_names)), candidate_parts, candidate_counts))
+        response_groups = [all_candidates] * len(remaining_names)
     
-    # If we have matches for each part and they're all good matches
-    return len(best_matches) > 0 and min(best_matches) >= threshold
+    fuzzy_max = np.zeros(len(remaining_names), dtype=np.uint8)
+    fuzzy_idx = np.zeros(len(remaining_names), dtype=np.intp)
+    for i, candidate_groups in enumerate(response_groups):
+        fuzzy_max[i], fuzzy_idx[i] = best_part_match(
+            response_parts[i], response_counts[i], candidate_groups, part_scores, similarity_threshold
+        )
+    
+    row_max = np.full(len(response_names), 100, dtype=np.uint8)
+    row_max[~exact_mask] = fuzzy_max
+    best_idx = exact_idx
+    best_idx[~exact_mask] = fuzzy_idx
+    return row_max, best_idx
 
 def read_file_safe(file_path, header:int=0):
     """
@@ -58,7 +182,14 @@ def read_file_safe(file_path, header:int=0):
     # Handle CSV files
     if file_path.lower().endswith('.csv'):
         try:
-            df = pd.read_csv(file_path)
+            # pyarrow's multi-threaded parser is much faster than pandas' default reader;
+            # names are always read as text so they are never parsed as numbers
+            table = pv.read_csv(
+                file_path,
+                read_options=pv.ReadOptions(use_threads=True),
+                convert_options=pv.ConvertOptions(column_types={COLUMN_KEY: pa.string()}),
+            )
+            df = table.to_pandas(types_mapper=pd.ArrowDtype)
             return df, None
         except Exception as e:
             print(f"Error reading CSV file {file_path}:")
@@ -67,13 +198,13 @@ def read_file_safe(file_path, header:int=0):
 
     # Handle Excel files
     try:
-        df = pd.read_excel(file_path, header=header)
+        df = pd.read_excel(file_path, header=header, engine=EXCEL_ENGINE)
         return df, 'default'
     except Exception as e1:
         try:
-            xls = pd.ExcelFile(file_path)
+            xls = pd.ExcelFile(file_path, engine=EXCEL_ENGINE)
             sheet_name = xls.sheet_names[0]
-            df = pd.read_excel(file_path, sheet_name=sheet_name, header=header)
+            df = pd.read_excel(xls, sheet_name=sheet_name, header=header)
             return df, sheet_name
         except Exception as e2:
             print(f"Error reading Excel file {file_path}:")
@@ -81,11 +212,15 @@ def read_file_safe(file_path, header:int=0):
             print(f"Second attempt error: {str(e2)}")
             return None, None
 
-def remove_duplicates(similarity_threshold=75):
+def remove_duplicates(similarity_threshold=75, use_blocking=False):
     """
     Remove entries from responses.csv that have similar names in registry.xlsx
     or surveillance.xlsx. Uses fuzzy string matching to handle spelling variations.
     Saves results in Excel format.
+    
+    With use_blocking, each response is only scored against candidates with the
+    same first character and a similar length. This is much faster on large
+    files but can miss matches that differ in their first letter or word order.
     """
     # Read all three files safely
     results = {
@@ -128,36 +263,29 @@ def remove_duplicates(similarity_threshold=75):
     surveillance_names = df_surveillance[COLUMN_KEY].tolist()
     all_names_to_check = registry_names + surveillance_names
     
-    # Keep track of removed names and their matches
-    removed_names = []
-    matches_found = []
-    removed_rows = []
-    
-    # Check each response name against all names in registry and surveillance
-    for idx, row in df_responses.iterrows():
-        response_name = row[COLUMN_KEY]
-        for check_name in all_names_to_check:
-            if is_similar_name(response_name, check_name, similarity_threshold):
-                removed_names.append(response_name)
-                matches_found.append(check_name)
-                removed_rows.append(row)
-                break
+    # Score every response against every name in registry and surveillance
+    response_names = df_responses[COLUMN_KEY].fillna('').astype(str).tolist()
+    all_names_to_check = [str(name) for name in all_names_to_check if not pd.isna(name)]
+    row_max, best_idx = match_names(
+        response_names, all_names_to_check, similarity_threshold, use_blocking
+    )
+    removed_mask = row_max >= similarity_threshold
     
     # Create DataFrame of removed facilities with their matches
-    if removed_rows:
-        df_removed = pd.DataFrame(removed_rows)
-        df_removed['Matched With'] = matches_found
+    df_removed = df_responses.loc[removed_mask].copy()
+    df_removed['Matched With'] = np.asarray(all_names_to_check, dtype=object)[best_idx[removed_mask]]
+    if not df_removed.empty:
         removed_file = 'spreadsheets/removed_facilities.xlsx'
-        df_removed.to_excel(removed_file, sheet_name='Removed Facilities', index=False)
+        save_dataframe(df_removed, removed_file, sheet_name='Removed Facilities')
         print(f"\nRemoved facilities saved to: {removed_file}")
     
     # Remove the similar names from responses
-    df_responses_filtered = df_responses[~df_responses[COLUMN_KEY].isin(removed_names)]
+    df_responses_filtered = df_responses.loc[~removed_mask]
     
     # Print which names were removed and their matches
-    if removed_names:
+    if not df_removed.empty:
         print(f"\nRemoved the following {COLUMN_KEY}s:")
-        for name, match in zip(removed_names, matches_found):
+        for name, match in zip(df_removed[COLUMN_KEY], df_removed['Matched With']):
             print(f"- {name} (matched with: {match})")
     
     # Create backup of original file
@@ -167,11 +295,11 @@ def remove_duplicates(similarity_threshold=75):
     
     # Save the filtered responses as Excel
     output_file = RESPONSES_FILE.replace('.csv', '_filtered.xlsx')
-    df_responses_filtered.to_excel(output_file, sheet_name='Filtered Responses', index=False)
+    save_dataframe(df_responses_filtered, output_file, sheet_name='Filtered Responses')
     print(f"\nFiltered responses saved to: {output_file}")
     
     # Print statistics
-    print(f"\nTotal removed: {len(removed_names)} similar {COLUMN_KEY}s")
+    print(f"\nTotal removed: {len(df_removed)} similar {COLUMN_KEY}s")
     print(f"Filtered responses file contains {len(df_responses_filtered)} entries")
 
 if __name__ == "__main__":